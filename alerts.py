@@ -0,0 +1,364 @@
+#!/usr/bin/env python3
+"""
+Incremental price alert engine for the trading dashboard
+Thresholds are indexed per symbol in sorted lists so each tick only
+touches the rules it can newly trigger
+"""
+import json
+import logging
+import math
+import os
+import random
+import re
+import tempfile
+import threading
+import time
+import uuid
+from bisect import bisect_left, bisect_right
+from collections import deque
+from dataclasses import dataclass, asdict
+from datetime import datetime
+from market_data import TICK_DATA_DIR, load_tick_stream
+
+logger = logging.getLogger(__name__)
+
+# Constants
+ALERTS_FILE = 'ALERTS/alert_rules.json'
+FIELDS = ('price', 'spread')
+DIRECTIONS = ('above', 'below')
+DEFAULT_COOLDOWN_SECONDS = 300
+DEFAULT_MAX_PER_MINUTE = 60
+RECENT_ALERTS_LIMIT = 100
+RULE_ID_PATTERN = re.compile(r'[A-Za-z0-9_.-]{1,64}')
+_RATE_LIMITED = object()  # _fire() marker for alerts dropped by max_per_minute
+SAVE_INTERVAL_SECONDS = 30  # throttle for state changes that are only new prices
+
+
+@dataclass
+class AlertRule:
+    """A single threshold rule, e.g. AAPL price above 150"""
+    rule_id: str
+    symbol: str
+    field: str
+    direction: str
+    threshold: float
+
+    def dedupe_key(self):
+        """Rules with the same condition share one notification"""
+        return f"{self.symbol}|{self.field}|{self.direction}|{self.threshold!r}"
+
+
+class _ThresholdIndex:
+    """Sorted thresholds with parallel rule ids for one symbol/field/direction"""
+
+    def __init__(self):
+        self.thresholds = []
+        self.rule_ids = []
+
+    def add(self, threshold, rule_id):
+        idx = bisect_right(self.thresholds, threshold)
+        self.thresholds.insert(idx, threshold)
+        self.rule_ids.insert(idx, rule_id)
+
+    def remove(self, threshold, rule_id):
+        lo = bisect_left(self.thresholds, threshold)
+        hi = bisect_right(self.thresholds, threshold)
+        for idx in range(lo, hi):
+            if self.rule_ids[idx] == rule_id:
+                del self.thresholds[idx]
+                del self.rule_ids[idx]
+                return
+
+    def crossed_up(self, previous, current):
+        """Rule ids with previous < threshold <= current"""
+        lo = bisect_right(self.thresholds, previous)
+        hi = bisect_right(self.thresholds, current)
+        return self.rule_ids[lo:hi]
+
+    def crossed_down(self, previous, current):
+        """Rule ids with current <= threshold < previous"""
+        lo = bisect_left(self.thresholds, current)
+        hi = bisect_left(self.thresholds, previous)
+        return self.rule_ids[lo:hi]
+
+    def __len__(self):
+        return len(self.thresholds)
+
+
+class AlertEngine:
+    """Evaluates alert rules incrementally as ticks arrive"""
+
+    def __init__(self, cooldown_seconds=DEFAULT_COOLDOWN_SECONDS,
+                 max_per_minute=DEFAULT_MAX_PER_MINUTE, notify=None):
+        self.cooldown_seconds = cooldown_seconds
+        self.max_per_minute = max_per_minute
+        self.notify = notify or self._log_notification
+        self.rules = {}
+        self.last_values = {}
+        self.last_fired = {}
+        self.recent_alerts = deque(maxlen=RECENT_ALERTS_LIMIT)
+        self._index = {}
+        self._sent_times = deque()
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+        self._dirty = False
+        self._rules_dirty = False
+        self._last_save = 0.0
+
+    def add_rule(self, rule_id, symbol, field, direction, threshold):
+        """Register a rule; replaces any existing rule with the same id"""
+        rule_id = str(rule_id or uuid.uuid4().hex[:12])
+        if not RULE_ID_PATTERN.fullmatch(rule_id):
+            raise ValueError("Alert rule_id must be 1-64 characters of letters, digits, '_', '.' or '-'")
+        if not symbol:
+            raise ValueError("Alert symbol is required")
+        if field not in FIELDS:
+            raise ValueError(f"Unknown alert field: {field}")
+        if direction not in DIRECTIONS:
+            raise ValueError(f"Unknown alert direction: {direction}")
+        threshold = float(threshold)
+        if not math.isfinite(threshold):
+            # NaN would break the sorted order bisect relies on
+            raise ValueError(f"Alert threshold must be a finite number: {threshold}")
+        rule = AlertRule(rule_id, str(symbol).upper(), field, direction, threshold)
+        with self._lock:
+            if rule.rule_id in self.rules:
+                self._unindex(self.rules[rule.rule_id])
+            self.rules[rule.rule_id] = rule
+            self._rules_dirty = True
+            key = (rule.symbol, rule.field, rule.direction)
+            self._index.setdefault(key, _ThresholdIndex()).add(rule.threshold, rule.rule_id)
+        return rule
+
+    def remove_rule(self, rule_id):
+        """Drop a rule; returns False if it was not registered"""
+        with self._lock:
+            rule = self.rules.pop(str(rule_id), None)
+            if rule is None:
+                return False
+            self._unindex(rule)
+            self._rules_dirty = True
+            return True
+
+    def has_rules(self, symbol, field):
+        """Whether any rule watches this symbol/field (e.g. to skip fetching quotes)"""
+        symbol = symbol.upper()
+        return any((symbol, field, direction) in self._index for direction in DIRECTIONS)
+
+    def _unindex(self, rule):
+        key = (rule.symbol, rule.field, rule.direction)
+        index = self._index.get(key)
+        if index is not None:
+            index.remove(rule.threshold, rule.rule_id)
+            if not index:
+                del self._index[key]
+
+    def on_tick(self, symbol, price, ask_price=None, now=None):
+        """Feed one quote and return the notifications it produced
+
+        The first value seen for a symbol/field only seeds the engine;
+        rules fire on a later tick that crosses their threshold.
+        """
+        now = time.time() if now is None else now
+        symbol = symbol.upper()
+        values = {'price': float(price)}
+        if ask_price is not None:
+            values['spread'] = float(ask_price) - float(price)
+
+        sent = []
+        dropped = 0
+        with self._lock:
+            for field, current in values.items():
+                previous = self.last_values.get(f"{symbol}|{field}")
+                if current == previous:
+                    continue
+                self.last_values[f"{symbol}|{field}"] = current
+                self._dirty = True
+                if previous is None:
+                    continue
+                if current > previous:
+                    index = self._index.get((symbol, field, 'above'))
+                    triggered = index.crossed_up(previous, current) if index else []
+                else:
+                    index = self._index.get((symbol, field, 'below'))
+                    triggered = index.crossed_down(previous, current) if index else []
+                for rule_id in triggered:
+                    alert = self._fire(self.rules[rule_id], current, now)
+                    if alert is _RATE_LIMITED:
+                        dropped += 1
+                    elif alert:
+                        sent.append(alert)
+
+        if dropped:
+            logger.warning(f"Alert rate limit reached, dropped {dropped} alerts for {symbol}")
+        for alert in sent:
+            self.notify(alert)
+        return sent
+
+    def _fire(self, rule, value, now):
+        """Apply dedupe and rate limiting; returns the alert, None or _RATE_LIMITED"""
+        key = rule.dedupe_key()
+        last = self.last_fired.get(key)
+        if last is not None and now - last < self.cooldown_seconds:
+            return None
+
+        while self._sent_times and now - self._sent_times[0] >= 60:
+            self._sent_times.popleft()
+        if len(self._sent_times) >= self.max_per_minute:
+            return _RATE_LIMITED
+
+        self.last_fired[key] = now
+        self._dirty = True
+        self._sent_times.append(now)
+        alert = {
+            'rule_id': rule.rule_id,
+            'symbol': rule.symbol,
+            'field': rule.field,
+            'direction': rule.direction,
+            'threshold': rule.threshold,
+            'value': value,
+            'timestamp': datetime.fromtimestamp(now).isoformat()
+        }
+        self.recent_alerts.append(alert)
+        return alert
+
+    def _log_notification(self, alert):
+        logger.info(f"🔔 {alert['symbol']} {alert['field']} {alert['direction']} "
+                    f"{alert['threshold']} (now {alert['value']:.4f})")
+
+    def save(self, path=ALERTS_FILE):
+        """Persist rules and evaluation state as JSON"""
+        with self._lock:
+            state = {
+                'rules': [asdict(rule) for rule in self.rules.values()],
+                'last_values': dict(self.last_values),
+                'last_fired': dict(self.last_fired)
+            }
+            self._dirty = False
+            self._rules_dirty = False
+            self._last_save = time.time()
+        directory = os.path.dirname(path) or '.'
+        with self._save_lock:
+            os.makedirs(directory, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.alerts-', suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'w') as f:
+                    json.dump(state, f, allow_nan=False)
+                os.replace(tmp_path, path)
+            except Exception:
+                os.unlink(tmp_path)
+                raise
+
+    def save_if_dirty(self, path=ALERTS_FILE, min_interval=SAVE_INTERVAL_SECONDS):
+        """Persist only when state changed; rule edits save at once, prices are throttled"""
+        with self._lock:
+            if self._rules_dirty:
+                due = True
+            else:
+                due = self._dirty and time.time() - self._last_save >= min_interval
+        if due:
+            self.save(path)
+        return due
+
+    @classmethod
+    def load(cls, path=ALERTS_FILE, **kwargs):
+        """Build an engine from a saved state file
+
+        Invalid rules are logged and skipped. A file that cannot be parsed
+        is moved aside to <path>.corrupt-<timestamp> so the next save does
+        not destroy it, and the engine starts empty.
+        """
+        engine = cls(**kwargs)
+        if not os.path.exists(path):
+            return engine
+        try:
+            with open(path, 'r') as f:
+                state = json.load(f)
+            rules = list(state.get('rules', []))
+            last_values = dict(state.get('last_values', {}))
+            last_fired = dict(state.get('last_fired', {}))
+        except Exception as e:
+            corrupt_path = f"{path}.corrupt-{time.time_ns()}"
+            logger.error(f"Error loading alert state from {path}, moved to {corrupt_path}: {e}")
+            os.replace(path, corrupt_path)
+            return engine
+
+        for rule in rules:
+            try:
+                engine.add_rule(**rule)
+            except Exception as e:
+                logger.error(f"Skipping invalid alert rule {rule!r}: {e}")
+        engine.last_values.update(last_values)
+        engine.last_fired.update(last_fired)
+        engine._rules_dirty = False
+        return engine
+
+    def __len__(self):
+        return len(self.rules)
+
+
+def run_benchmark(rule_count=10000, repeats=50, seed=42):
+    """Replay tick_data against rule_count random rules, vs a full scan"""
+    ticks = load_tick_stream()
+    if not ticks:
+        logger.error(f"No tick data found in {TICK_DATA_DIR}")
+        return
+
+    ranges = {}
+    for _, symbol, price, ask in ticks:
+        low, high, spread = ranges.get(symbol, (price, price, 0.0))
+        ranges[symbol] = (min(low, price), max(high, price), max(spread, ask - price))
+
+    rng = random.Random(seed)
+    engine = AlertEngine(cooldown_seconds=0, max_per_minute=float('inf'), notify=lambda alert: None)
+    symbols = sorted(ranges)
+    for i in range(rule_count):
+        symbol = rng.choice(symbols)
+        low, high, spread = ranges[symbol]
+        field = rng.choice(FIELDS)
+        if field == 'price':
+            threshold = rng.uniform(low * 0.75, high * 1.25)
+        else:
+            threshold = rng.uniform(0, spread * 4)
+        engine.add_rule(f"r{i}", symbol, field, rng.choice(DIRECTIONS), threshold)
+
+    # Replay the stream several times, shifting timestamps to keep them increasing
+    span = ticks[-1][0] - ticks[0][0] + 60
+    stream = [(ts + n * span, symbol, price, ask)
+              for n in range(repeats) for ts, symbol, price, ask in ticks]
+
+    start = time.perf_counter()
+    indexed_fired = 0
+    for ts, symbol, price, ask in stream:
+        indexed_fired += len(engine.on_tick(symbol, price, ask, now=ts))
+    indexed_elapsed = time.perf_counter() - start
+
+    rules = list(engine.rules.values())
+    last_values = {}
+    start = time.perf_counter()
+    naive_fired = 0
+    for ts, symbol, price, ask in stream:
+        for field, current in (('price', price), ('spread', ask - price)):
+            previous = last_values.get((symbol, field))
+            last_values[(symbol, field)] = current
+            if previous is None:
+                continue
+            for rule in rules:
+                if rule.symbol != symbol or rule.field != field:
+                    continue
+                if rule.direction == 'above' and previous < rule.threshold <= current:
+                    naive_fired += 1
+                elif rule.direction == 'below' and current <= rule.threshold < previous:
+                    naive_fired += 1
+    naive_elapsed = time.perf_counter() - start
+
+    per_tick_us = indexed_elapsed / len(stream) * 1e6
+    print(f"Rules: {len(engine)}  Ticks: {len(stream)}  Alerts: {indexed_fired}")
+    print(f"Indexed engine: {indexed_elapsed:.3f}s ({per_tick_us:.1f} us/tick)")
+    print(f"Full re-scan:   {naive_elapsed:.3f}s ({naive_elapsed / len(stream) * 1e6:.1f} us/tick)")
+    print(f"Speedup: {naive_elapsed / indexed_elapsed:.1f}x  Results match: {indexed_fired == naive_fired}")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    run_benchmark(rule_count=int(os.environ.get("ALERT_BENCH_RULES", 10000)))
@@ -0,0 +1,24 @@
+#!/usr/bin/env python3
+"""
+Shared loaders for recorded market data
+"""
+import csv
+import glob
+import os
+from datetime import datetime
+
+# Constants
+TICK_DATA_DIR = 'tick_data'
+
+
+def load_tick_stream(directory=TICK_DATA_DIR):
+    """Load tick_data CSVs as one time-ordered list of (timestamp, symbol, price, ask)"""
+    ticks = []
+    for path in sorted(glob.glob(os.path.join(directory, '*.csv'))):
+        symbol = os.path.splitext(os.path.basename(path))[0].upper()
+        with open(path, 'r') as f:
+            for row in csv.DictReader(f):
+                ts = datetime.strptime(row['timestamp'], '%Y-%m-%d %H:%M').timestamp()
+                ticks.append((ts, symbol, float(row['price']), float(row['ask_price'])))
+    ticks.sort(key=lambda tick: tick[0])
+    return ticks
@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+"""
+On-demand profiling helpers for the dashboard server
+Sampling profiler plus per-stage timing capture for slow requests
+"""
+import hmac
+import os
+import sys
+import threading
+import time
+from collections import Counter, deque
+from contextlib import contextmanager
+from datetime import datetime
+from functools import wraps
+
+# Constants
+PROFILE_TOKEN_ENV = 'DEBUG_PROFILE_TOKEN'
+DEFAULT_SAMPLE_INTERVAL = 0.01
+MIN_SAMPLE_INTERVAL = 0.001
+MAX_SAMPLE_INTERVAL = 1.0
+MAX_PROFILE_SECONDS = 30
+SLOW_REQUEST_MS = float(os.environ.get('SLOW_REQUEST_MS', 1000))
+SLOW_REQUEST_BUFFER = int(os.environ.get('SLOW_REQUEST_BUFFER', 50))
+
+_profile_lock = threading.Lock()
+_current = threading.local()
+slow_requests = deque(maxlen=SLOW_REQUEST_BUFFER)
+
+
+def is_authorized(token, env_name=PROFILE_TOKEN_ENV):
+    """Guarded endpoints are disabled unless the token env var is set and matches"""
+    expected = os.environ.get(env_name)
+    if not expected or not token:
+        return False
+    return hmac.compare_digest(token.encode('utf-8'), expected.encode('utf-8'))
+
+
+def _frame_label(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def sample_stacks(seconds, interval=DEFAULT_SAMPLE_INTERVAL):
+    """Sample every other thread's stack for the given duration
+
+    Returns a Counter of collapsed stacks (root first, ';'-separated) and
+    the number of sampling passes taken. Returns None if another profile
+    is already running.
+    """
+    if not _profile_lock.acquire(blocking=False):
+        return None
+    try:
+        own_id = threading.get_ident()
+        stacks = Counter()
+        passes = 0
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                labels = []
+                while frame is not None:
+                    labels.append(_frame_label(frame))
+                    frame = frame.f_back
+                stacks[';'.join(reversed(labels))] += 1
+            passes += 1
+            time.sleep(interval)
+        return stacks, passes
+    finally:
+        _profile_lock.release()
+
+
+def collapsed_text(stacks):
+    """Brendan Gregg collapsed format, readable by flamegraph.pl and speedscope"""
+    return '\n'.join(f"{stack} {count}" for stack, count in stacks.most_common())
+
+
+def flamegraph_tree(stacks):
+    """Nested {name, value, children} tree as used by d3-flame-graph"""
+    root = {'name': 'root', 'value': 0, 'children': {}}
+    for stack, count in stacks.items():
+        root['value'] += count
+        node = root
+        for label in stack.split(';'):
+            child = node['children'].setdefault(label, {'name': label, 'value': 0, 'children': {}})
+            child['value'] += count
+            node = child
+
+    def finalize(node):
+        node['children'] = [finalize(child) for child in node['children'].values()]
+        return node
+
+    return finalize(root)
+
+
+class RequestTimer:
+    """Collects nested stage timings for one request
+
+    Stages are kept in start order with their nesting depth and start
+    offset, so a parent's ms includes the children listed after it.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.started = time.perf_counter()
+        self.stages = []
+        self.depth = 0
+
+    def total_ms(self):
+        return (time.perf_counter() - self.started) * 1000
+
+    def to_dict(self):
+        return {
+            'path': self.path,
+            'timestamp': datetime.now().isoformat(),
+            'total_ms': round(self.total_ms(), 2),
+            'stages': [
+                {'stage': name, 'depth': depth, 'start_ms': round(start_ms, 2),
+                 'ms': round(ms, 2) if ms is not None else None}
+                for name, depth, start_ms, ms in self.stages
+            ]
+        }
+
+
+@contextmanager
+def track_request(path, threshold_ms=SLOW_REQUEST_MS):
+    """Time a request and keep its stage breakdown if it was slow"""
+    timer = RequestTimer(path)
+    _current.timer = timer
+    try:
+        yield timer
+    finally:
+        _current.timer = None
+        if timer.total_ms() >= threshold_ms:
+            slow_requests.append(timer.to_dict())
+
+
+@contextmanager
+def stage(name):
+    """Record the duration of a block against the current request, if any"""
+    timer = getattr(_current, 'timer', None)
+    if timer is None:
+        yield
+        return
+    started = time.perf_counter()
+    # Record on entry so parents precede their children; ms is filled on exit
+    entry = [name, timer.depth, (started - timer.started) * 1000, None]
+    timer.stages.append(entry)
+    timer.depth += 1
+    try:
+        yield
+    finally:
+        timer.depth -= 1
+        entry[3] = (time.perf_counter() - started) * 1000
+
+
+def timed_stage(name):
+    """Decorator form of stage()"""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
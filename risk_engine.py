@@ -0,0 +1,300 @@
+#!/usr/bin/env python3
+"""
+Rolling cross-asset risk engine for the trading dashboard
+Keeps a window of minute returns for every watched symbol and updates
+covariance incrementally with NumPy as each bar lands
+"""
+import logging
+import os
+import threading
+import time
+import numpy as np
+from market_data import load_tick_stream
+
+logger = logging.getLogger(__name__)
+
+# Constants
+DEFAULT_WINDOW = 390  # one regular trading session of minute bars
+MINUTES_PER_YEAR = 390 * 252
+RESYNC_EVERY = DEFAULT_WINDOW  # full recompute cadence to wash out float drift
+MIN_OBSERVATIONS = 20  # returns in the window before a symbol counts toward risk
+
+
+class RiskEngine:
+    """Rolling return matrix with running sums for O(n^2) per-bar covariance updates
+
+    Missing observations are masked rather than forward-filled. Covariance
+    is computed pairwise over the bars where both symbols have a return,
+    from three running matrices: cross products, masked sums and pair counts.
+    """
+
+    def __init__(self, symbols, window=DEFAULT_WINDOW):
+        self.symbols = [symbol.upper() for symbol in symbols]
+        self.positions = {symbol: i for i, symbol in enumerate(self.symbols)}
+        self.window = window
+        n = len(self.symbols)
+        self.returns = np.zeros((window, n))
+        self.valid = np.zeros((window, n))
+        self.count = 0
+        self.cursor = 0
+        self.cross = np.zeros((n, n))
+        self.sums = np.zeros((n, n))
+        self.pairs = np.zeros((n, n))
+        self.last_close = np.full(n, np.nan)
+        self.pending = np.full(n, np.nan)
+        self.pending_minute = None
+        self.last_bar_minute = None
+        self._updates_since_resync = 0
+        self._lock = threading.Lock()
+
+    def add_symbol(self, symbol):
+        """Start tracking a new symbol; it has no observations until it quotes"""
+        symbol = symbol.upper()
+        with self._lock:
+            if symbol in self.positions:
+                return
+            self.positions[symbol] = len(self.symbols)
+            self.symbols.append(symbol)
+            self.returns = np.pad(self.returns, ((0, 0), (0, 1)))
+            self.valid = np.pad(self.valid, ((0, 0), (0, 1)))
+            self.cross = np.pad(self.cross, ((0, 1), (0, 1)))
+            self.sums = np.pad(self.sums, ((0, 1), (0, 1)))
+            self.pairs = np.pad(self.pairs, ((0, 1), (0, 1)))
+            self.last_close = np.append(self.last_close, np.nan)
+            self.pending = np.append(self.pending, np.nan)
+
+    def on_quote(self, symbol, price, timestamp=None):
+        """Stage a quote; the first quote of a new minute closes the previous bar"""
+        timestamp = time.time() if timestamp is None else timestamp
+        minute = int(timestamp // 60)
+        symbol = symbol.upper()
+        if symbol not in self.positions:
+            self.add_symbol(symbol)
+        with self._lock:
+            if self.pending_minute is not None and minute > self.pending_minute:
+                self._close_bar()
+            self.pending_minute = minute
+            self.pending[self.positions[symbol]] = float(price)
+
+    def flush(self):
+        """Close the bar currently being built"""
+        with self._lock:
+            if self.pending_minute is not None:
+                self._close_bar()
+                self.pending_minute = None
+
+    def _close_bar(self):
+        # Only adjacent minutes give a one-minute return; after any gap
+        # (overnight, weekend, nobody loading the page) start a new baseline
+        if self.last_bar_minute is None or self.pending_minute - self.last_bar_minute != 1:
+            self.last_close = np.full(len(self.symbols), np.nan)
+        # Symbols missing from either bar get no return (NaN) rather than 0
+        with np.errstate(invalid='ignore', divide='ignore'):
+            bar_returns = np.log(self.pending / self.last_close)
+        bar_returns[~np.isfinite(bar_returns)] = np.nan
+        if not np.all(np.isnan(bar_returns)):
+            self._append(bar_returns[np.newaxis, :])
+        self.last_close = self.pending
+        self.last_bar_minute = self.pending_minute
+        self.pending = np.full(len(self.symbols), np.nan)
+
+    def update_returns(self, bar_returns):
+        """Push a (bars x symbols) block of returns in one batched update; NaN marks missing"""
+        bar_returns = np.atleast_2d(np.asarray(bar_returns, dtype=float))
+        with self._lock:
+            self._append(bar_returns)
+
+    def _append(self, block):
+        if len(block) > self.window:
+            block = block[-self.window:]
+        k = len(block)
+        mask = (~np.isnan(block)).astype(float)
+        block = np.nan_to_num(block, nan=0.0)
+        slots = (self.cursor + np.arange(k)) % self.window
+        if self.count + k > self.window:
+            # Rows being overwritten leave the window; fold add and evict into one matmul each
+            overwritten = slots[self.window - self.count:]
+            evicted, evicted_mask = self.returns[overwritten], self.valid[overwritten]
+            values = np.vstack([block, evicted])
+            if k == len(overwritten) and mask.all() and evicted_mask.all():
+                # Fully observed rows in and out: pair counts are unchanged and
+                # the masked sums reduce to a broadcast column update
+                self.cross += values.T @ np.vstack([block, -evicted])
+                self.sums += (block.sum(axis=0) - evicted.sum(axis=0))[:, np.newaxis]
+                self._finish_append(block, mask, slots, k)
+                return
+            masks = np.vstack([mask, evicted_mask])
+            signed_mask = np.vstack([mask, -evicted_mask])
+            self.cross += values.T @ np.vstack([block, -evicted])
+            self.sums += values.T @ signed_mask
+            self.pairs += masks.T @ signed_mask
+        else:
+            self.cross += block.T @ block
+            self.sums += block.T @ mask
+            self.pairs += mask.T @ mask
+        self._finish_append(block, mask, slots, k)
+
+    def _finish_append(self, block, mask, slots, k):
+        self.returns[slots] = block
+        self.valid[slots] = mask
+        self.cursor = (self.cursor + k) % self.window
+        self.count = min(self.count + k, self.window)
+
+        self._updates_since_resync += k
+        if self._updates_since_resync >= RESYNC_EVERY:
+            self._resync()
+
+    def _resync(self):
+        values, mask = self.returns[:self.count], self.valid[:self.count]
+        self.cross = values.T @ values
+        self.sums = values.T @ mask
+        self.pairs = mask.T @ mask
+        self._updates_since_resync = 0
+
+    def observations(self):
+        """Number of returns each symbol has in the current window"""
+        with self._lock:
+            return np.diag(self.pairs).copy()
+
+    def covariance(self):
+        """Pairwise sample covariance of minute log returns
+
+        Pairs with fewer than two shared observations are NaN; returns None
+        with under two bars in the window.
+        """
+        with self._lock:
+            return self._covariance_locked()
+
+    def _covariance_locked(self):
+        if self.count < 2:
+            return None
+        with np.errstate(invalid='ignore', divide='ignore'):
+            cov = (self.cross - self.sums * self.sums.T / self.pairs) / (self.pairs - 1)
+        cov[self.pairs < 2] = np.nan
+        return cov
+
+    def correlation(self):
+        """Correlation matrix; pairs without enough shared data get zero correlation"""
+        cov = self.covariance()
+        if cov is None:
+            return None
+        std = np.sqrt(np.clip(np.nan_to_num(np.diag(cov)), 0, None))
+        with np.errstate(invalid='ignore', divide='ignore'):
+            corr = cov / np.outer(std, std)
+        corr = np.nan_to_num(corr, nan=0.0, posinf=0.0, neginf=0.0)
+        np.fill_diagonal(corr, np.where(std > 0, 1.0, 0.0))
+        return corr
+
+    def portfolio_risk(self, market_values, equity=None):
+        """Portfolio volatility and per-position exposure from {symbol: market value}
+
+        Positions with fewer than MIN_OBSERVATIONS returns in the window are
+        left out of the volatility and reported under untracked_exposure.
+        """
+        # One consistent snapshot; quotes may be adding symbols concurrently
+        with self._lock:
+            cov = self._covariance_locked()
+            observations = np.diag(self.pairs).copy()
+            positions = dict(self.positions)
+            count = self.count
+        market_values = {symbol.upper(): float(value) for symbol, value in market_values.items()}
+        gross = sum(abs(value) for value in market_values.values())
+        equity = float(equity) if equity else gross
+        tracked = []
+        if cov is not None and equity:
+            tracked = [symbol for symbol in market_values if symbol in positions
+                       and observations[positions[symbol]] >= MIN_OBSERVATIONS]
+        untracked = [symbol for symbol in market_values if symbol not in tracked]
+        report = {
+            'bars': count,
+            'equity': equity,
+            'gross_exposure': gross,
+            'net_exposure': sum(market_values.values()),
+            'untracked_exposure': sum(abs(market_values[symbol]) for symbol in untracked),
+            'untracked_symbols': untracked,
+            'volatility_minute': None,
+            'volatility_annualized': None,
+            'positions': []
+        }
+
+        if tracked:
+            idx = np.array([positions[symbol] for symbol in tracked], dtype=int)
+            weights = np.array([market_values[symbol] for symbol in tracked]) / equity
+            # Pairs with too little overlap contribute no covariance
+            sub_cov = np.nan_to_num(cov[np.ix_(idx, idx)])
+            marginal = sub_cov @ weights
+            variance = max(float(weights @ marginal), 0.0)
+            vol = np.sqrt(variance)
+            contributions = weights * marginal / variance if variance > 0 else np.zeros(len(tracked))
+            asset_vol = np.sqrt(np.clip(np.diag(sub_cov), 0, None) * MINUTES_PER_YEAR)
+
+            report['volatility_minute'] = float(vol)
+            report['volatility_annualized'] = float(vol * np.sqrt(MINUTES_PER_YEAR))
+            for i, symbol in enumerate(tracked):
+                report['positions'].append({
+                    'symbol': symbol,
+                    'market_value': market_values[symbol],
+                    'weight': float(weights[i]),
+                    'observations': int(observations[idx[i]]),
+                    'volatility_annualized': float(asset_vol[i]),
+                    'risk_contribution': float(contributions[i])
+                })
+        for symbol in untracked:
+            report['positions'].append({
+                'symbol': symbol,
+                'market_value': market_values[symbol],
+                'weight': market_values[symbol] / equity if equity else None,
+                'observations': int(observations[positions[symbol]]) if symbol in positions else 0,
+                'volatility_annualized': None,
+                'risk_contribution': None
+            })
+        return report
+
+    def __len__(self):
+        return len(self.symbols)
+
+
+def load_from_tick_data(symbols=(), window=DEFAULT_WINDOW):
+    """Build an engine and replay the tick_data CSVs through it"""
+    ticks = load_tick_stream()
+    engine = RiskEngine(sorted(set(s.upper() for s in symbols) | {tick[1] for tick in ticks}), window)
+    for ts, symbol, price, _ in ticks:
+        engine.on_quote(symbol, price, ts)
+    engine.flush()
+    return engine
+
+
+def run_benchmark(symbol_count=500, bars=2000, window=DEFAULT_WINDOW, seed=7):
+    """Time incremental updates against a full np.cov recompute per bar"""
+    rng = np.random.default_rng(seed)
+    factor = rng.normal(0, 0.001, size=(bars, 1))
+    returns = factor * rng.uniform(0.5, 1.5, size=symbol_count) + rng.normal(0, 0.001, size=(bars, symbol_count))
+    engine = RiskEngine([f"S{i}" for i in range(symbol_count)], window)
+
+    start = time.perf_counter()
+    for row in returns:
+        engine.update_returns(row)
+    incremental = time.perf_counter() - start
+
+    start = time.perf_counter()
+    engine.covariance()
+    query = time.perf_counter() - start
+
+    sample = min(bars, 200)
+    start = time.perf_counter()
+    for i in range(bars - sample, bars):
+        np.cov(returns[max(0, i + 1 - window):i + 1], rowvar=False)
+    full = (time.perf_counter() - start) / sample * bars
+
+    expected = np.cov(returns[-window:], rowvar=False)
+    max_error = float(np.max(np.abs(engine.covariance() - expected)))
+    print(f"Symbols: {symbol_count}  Bars: {bars}  Window: {window}")
+    print(f"Incremental: {incremental:.3f}s ({incremental / bars * 1e3:.2f} ms/bar)")
+    print(f"Covariance query: {query * 1e3:.2f} ms")
+    print(f"Full recompute (est.): {full:.3f}s ({full / bars * 1e3:.2f} ms/bar)")
+    print(f"Speedup: {full / incremental:.1f}x  Max abs error: {max_error:.2e}")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    run_benchmark(symbol_count=int(os.environ.get("RISK_BENCH_SYMBOLS", 500)))
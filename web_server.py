@@ -4,14 +4,20 @@ Web Server for LIVE DevOps Demo Dashboard
 Designed for Cloud Run deployment
 """
 import json
+import math
 import os
 import time
 from datetime import datetime
 from pytz import timezone
 import pandas as pd
 import alpaca_trade_api as alpaca
-from http.server import HTTPServer, BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs, unquote
 import logging
+from alerts import AlertEngine, ALERTS_FILE
+from risk_engine import load_from_tick_data
+import profiler
+from profiler import stage, timed_stage
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -24,10 +30,44 @@ AUTH_FILE = 'AUTH/auth.txt'
 TICKERS_FILE = 'TICKERS/my_tickers.txt'
 CONTENT_TYPE_HTML = 'text/html'
 CONTENT_TYPE_JSON = 'application/json'
+CONTENT_TYPE_TEXT = 'text/plain'
+ALERTS_TOKEN_ENV = 'ALERTS_API_TOKEN'
+MAX_BODY_BYTES = 64 * 1024
 DEMO_GRADIENT = 'linear-gradient(135deg, #FF6B6B 0%, #4ECDC4 100%)'
 
+# Price alerts persist across requests (rules live in ALERTS_FILE)
+alert_engine = AlertEngine.load(ALERTS_FILE)
+
+# Rolling return matrix seeded from tick_data, then fed live quotes
+risk_engine = load_from_tick_data()
+
 class DashboardHandler(BaseHTTPRequestHandler):
     def do_GET(self):
+        path = urlsplit(self.path).path
+        if path.startswith('/debug/'):
+            # Keep profiling runs out of the slow request log
+            self.route_get()
+            return
+        with profiler.track_request(path):
+            self.route_get()
+
+    def do_POST(self):
+        path = unquote(urlsplit(self.path).path)
+        with profiler.track_request(path):
+            if path == '/api/alerts':
+                self.create_alert_rule()
+            else:
+                self.send_json(404, json.dumps({'error': 'Not found'}))
+
+    def do_DELETE(self):
+        path = unquote(urlsplit(self.path).path)
+        with profiler.track_request(path):
+            if path.startswith('/api/alerts/'):
+                self.delete_alert_rule(path[len('/api/alerts/'):])
+            else:
+                self.send_json(404, json.dumps({'error': 'Not found'}))
+
+    def route_get(self):
         if self.path == '/' or self.path == '/dashboard':
             self.send_response(200)
             self.send_header('Content-type', CONTENT_TYPE_HTML)
@@ -62,6 +102,33 @@ class DashboardHandler(BaseHTTPRequestHandler):
             status_data = self.get_bot_status_json()
             self.wfile.write(status_data.encode('utf-8'))
         
+        elif self.path == '/api/alerts':
+            # Recent alerts expose rule details, so they share the rules token
+            if not self.alerts_authorized():
+                return
+            alerts_data = json.dumps({
+                'rules_count': len(alert_engine),
+                'recent_alerts': list(alert_engine.recent_alerts)
+            }, indent=2)
+            self.send_json(200, alerts_data)
+        
+        elif self.path == '/api/alerts/rules':
+            if not self.alerts_authorized():
+                return
+            rules = [vars(rule) for rule in list(alert_engine.rules.values())]
+            self.send_json(200, json.dumps({'rules': rules}, indent=2, allow_nan=False))
+        
+        elif self.path == '/api/risk':
+            self.send_response(200)
+            self.send_header('Content-type', CONTENT_TYPE_JSON)
+            self.send_header('Access-Control-Allow-Origin', '*')
+            self.end_headers()
+            risk_data = self.get_portfolio_risk_json()
+            self.wfile.write(risk_data.encode('utf-8'))
+        
+        elif urlsplit(self.path).path.startswith('/debug/'):
+            self.handle_debug_request()
+        
         else:
             self.send_response(404)
             self.send_header('Content-type', CONTENT_TYPE_HTML)
@@ -80,6 +147,107 @@ class DashboardHandler(BaseHTTPRequestHandler):
             '''
             self.wfile.write(error_html.encode('utf-8'))
     
+    def handle_debug_request(self):
+        """Serve /debug/profile and /debug/slow_requests (token guarded)"""
+        url = urlsplit(self.path)
+        query = parse_qs(url.query)
+        # Header only: query strings end up in the platform request logs
+        token = self.headers.get('X-Debug-Token')
+        if url.path not in ('/debug/profile', '/debug/slow_requests') or not profiler.is_authorized(token):
+            # Hide debug endpoints entirely from unauthorized callers
+            self.send_response(404)
+            self.end_headers()
+            return
+        
+        if url.path == '/debug/slow_requests':
+            body = json.dumps({
+                'threshold_ms': profiler.SLOW_REQUEST_MS,
+                'requests': list(profiler.slow_requests)
+            }, indent=2)
+            self.send_json(200, body)
+            return
+        
+        try:
+            seconds = float(query.get('seconds', ['5'])[0])
+            interval = float(query.get('interval', [profiler.DEFAULT_SAMPLE_INTERVAL])[0])
+        except ValueError:
+            seconds = interval = math.nan
+        if not (math.isfinite(seconds) and math.isfinite(interval)):
+            self.send_json(400, json.dumps({'error': 'seconds and interval must be finite numbers'}))
+            return
+        seconds = min(max(seconds, 0.1), profiler.MAX_PROFILE_SECONDS)
+        interval = min(max(interval, profiler.MIN_SAMPLE_INTERVAL), profiler.MAX_SAMPLE_INTERVAL)
+        
+        result = profiler.sample_stacks(seconds, interval)
+        if result is None:
+            self.send_json(409, json.dumps({'error': 'A profile is already running'}))
+            return
+        stacks, passes = result
+        
+        if query.get('format', ['collapsed'])[0] == 'json':
+            body = json.dumps({
+                'seconds': seconds,
+                'samples': passes,
+                'flamegraph': profiler.flamegraph_tree(stacks)
+            })
+            self.send_json(200, body)
+        else:
+            self.send_response(200)
+            self.send_header('Content-type', CONTENT_TYPE_TEXT)
+            self.end_headers()
+            self.wfile.write(profiler.collapsed_text(stacks).encode('utf-8'))
+    
+    def alerts_authorized(self):
+        """The alerts API needs ALERTS_API_TOKEN, sent as X-Alerts-Token"""
+        if profiler.is_authorized(self.headers.get('X-Alerts-Token'), ALERTS_TOKEN_ENV):
+            return True
+        self.send_json(403, json.dumps({'error': f'The alerts API requires {ALERTS_TOKEN_ENV}'}))
+        return False
+    
+    def create_alert_rule(self):
+        """Add a rule from a JSON body: symbol, field, direction, threshold, optional rule_id"""
+        if not self.alerts_authorized():
+            return
+        try:
+            length = int(self.headers.get('Content-Length') or 0)
+        except ValueError:
+            length = 0
+        if length <= 0 or length > MAX_BODY_BYTES:
+            self.send_json(400, json.dumps({'error': 'A JSON body is required'}))
+            return
+        try:
+            body = json.loads(self.rfile.read(length))
+            rule = alert_engine.add_rule(
+                body.get('rule_id'),
+                body.get('symbol'),
+                body.get('field', 'price'),
+                body.get('direction'),
+                body.get('threshold')
+            )
+        except (ValueError, TypeError, AttributeError) as e:
+            self.send_json(400, json.dumps({'error': f'Invalid alert rule: {e}'}))
+            return
+        alert_engine.save_if_dirty(ALERTS_FILE)
+        self.send_json(201, json.dumps(vars(rule)))
+    
+    def delete_alert_rule(self, rule_id):
+        """Remove a rule by id"""
+        if not self.alerts_authorized():
+            return
+        if not alert_engine.remove_rule(rule_id):
+            self.send_json(404, json.dumps({'error': f'No alert rule {rule_id}'}))
+            return
+        alert_engine.save_if_dirty(ALERTS_FILE)
+        self.send_json(200, json.dumps({'deleted': rule_id}))
+    
+    def send_json(self, code, body):
+        """Write a JSON response"""
+        self.send_response(code)
+        self.send_header('Content-type', CONTENT_TYPE_JSON)
+        self.end_headers()
+        self.wfile.write(body.encode('utf-8'))
+    
+    @timed_stage('get_bot_status_json')
     def get_bot_status_json(self):
         """Get bot status as JSON for API endpoint"""
         try:
@@ -101,9 +269,12 @@ class DashboardHandler(BaseHTTPRequestHandler):
             )
             
             # Get current data
-            account = api.get_account()
-            clock = api.get_clock()
-            positions = api.list_positions()
+            with stage('alpaca.get_account'):
+                account = api.get_account()
+            with stage('alpaca.get_clock'):
+                clock = api.get_clock()
+            with stage('alpaca.list_positions'):
+                positions = api.list_positions()
             
             with open(TICKERS_FILE, 'r') as f:
                 tickers = f.read().upper().split()
@@ -112,7 +283,8 @@ class DashboardHandler(BaseHTTPRequestHandler):
             ticker_prices = {}
             for ticker in tickers[:3]:
                 try:
-                    trade = api.get_latest_trade(ticker)
+                    with stage(f'alpaca.get_latest_trade:{ticker}'):
+                        trade = api.get_latest_trade(ticker)
                     ticker_prices[ticker] = float(trade.price)
                 except Exception:
                     ticker_prices[ticker] = 0
@@ -164,6 +336,32 @@ class DashboardHandler(BaseHTTPRequestHandler):
                 'message': 'Unable to fetch bot status'
             })
     
+    @timed_stage('get_portfolio_risk_json')
+    def get_portfolio_risk_json(self):
+        """Get portfolio volatility and exposure by position as JSON"""
+        data = self.load_dashboard_data()
+        if not data:
+            return json.dumps({
+                'error': 'Configuration files not found',
+                'status': 'Configuration Error',
+                'message': f'{AUTH_FILE} or {TICKERS_FILE} not found'
+            })
+        
+        try:
+            market_values = {p.symbol: float(p.market_value) for p in data['positions']}
+            risk = risk_engine.portfolio_risk(market_values, data['account'].portfolio_value)
+            risk['timestamp'] = datetime.now().isoformat()
+            risk['symbols_tracked'] = len(risk_engine)
+            return json.dumps(risk, indent=2)
+        except Exception as e:
+            logger.error(f"Error computing portfolio risk: {e}")
+            return json.dumps({
+                'error': str(e),
+                'status': 'Error',
+                'message': 'Unable to compute portfolio risk'
+            })
+    
+    @timed_stage('load_dashboard_data')
     def load_dashboard_data(self):
         """Load all data needed for dashboard"""
         try:
@@ -181,9 +379,12 @@ class DashboardHandler(BaseHTTPRequestHandler):
             )
             
             # Get current data
-            account = api.get_account()
-            clock = api.get_clock()
-            positions = api.list_positions()
+            with stage('alpaca.get_account'):
+                account = api.get_account()
+            with stage('alpaca.get_clock'):
+                clock = api.get_clock()
+            with stage('alpaca.list_positions'):
+                positions = api.list_positions()
             et_tz = timezone('America/New_York')
             current_time = datetime.now(et_tz)
             
@@ -202,24 +403,64 @@ class DashboardHandler(BaseHTTPRequestHandler):
             logger.error(f"Error loading dashboard data: {e}")
             return None
 
+    @timed_stage('get_ticker_data')
     def get_ticker_data(self, api, tickers):
         """Get ticker price data (limited for performance)"""
         ticker_data = []
         # Limit to first 4 tickers for Cloud Run performance
         for ticker in tickers[:4]:
             try:
-                trade = api.get_latest_trade(ticker)
+                with stage(f'alpaca.get_latest_trade:{ticker}'):
+                    trade = api.get_latest_trade(ticker)
                 ticker_data.append({
                     'symbol': ticker,
-                    'price': float(trade.price)
+                    'price': float(trade.price),
+                    'ask_price': self.get_ask_price(api, ticker)
                 })
             except Exception:
                 ticker_data.append({
                     'symbol': ticker,
                     'price': 'Error'
                 })
+        self.check_price_alerts(ticker_data)
+        self.update_risk_engine(ticker_data)
         return ticker_data
 
+    def get_ask_price(self, api, ticker):
+        """Latest ask for spread alerts; only fetched when a spread rule needs it"""
+        if not alert_engine.has_rules(ticker, 'spread'):
+            return None
+        try:
+            with stage(f'alpaca.get_latest_quote:{ticker}'):
+                quote = api.get_latest_quote(ticker)
+            ask_price = float(quote.ask_price)
+            # Alpaca reports a zero ask when there is no live quote
+            return ask_price if ask_price > 0 else None
+        except Exception:
+            return None
+
+    @timed_stage('update_risk_engine')
+    def update_risk_engine(self, ticker_data):
+        """Stage fresh quotes into the current minute bar of the risk engine"""
+        try:
+            for ticker in ticker_data:
+                if ticker['price'] != 'Error':
+                    risk_engine.on_quote(ticker['symbol'], ticker['price'])
+        except Exception as e:
+            logger.error(f"Error updating risk engine: {e}")
+
+    @timed_stage('check_price_alerts')
+    def check_price_alerts(self, ticker_data):
+        """Feed fresh quotes to the alert engine and persist its state"""
+        try:
+            for ticker in ticker_data:
+                if ticker['price'] != 'Error':
+                    alert_engine.on_tick(ticker['symbol'], ticker['price'], ticker.get('ask_price'))
+            alert_engine.save_if_dirty(ALERTS_FILE)
+        except Exception as e:
+            logger.error(f"Error checking price alerts: {e}")
+
+    @timed_stage('get_dashboard_trading_history')
     def get_dashboard_trading_history(self):
         """Get trading history for dashboard"""
         trading_history = []
@@ -233,6 +474,7 @@ class DashboardHandler(BaseHTTPRequestHandler):
                 pass
         return trading_history
 
+    @timed_stage('generate_dashboard_html')
     def generate_dashboard_html(self):
         """Generate the main dashboard HTML"""
         # Load all data
@@ -307,6 +549,7 @@ class DashboardHandler(BaseHTTPRequestHandler):
         </html>
         """
 
+    @timed_stage('generate_main_html_template')
     def generate_main_html_template(self, clock, account, positions, bot_mode, first_trade_made, ticker_data, trading_history):
         """Generate the main HTML template"""
         market_status_emoji = "🟢" if clock.is_open else "🔴"
@@ -535,6 +778,7 @@ class DashboardHandler(BaseHTTPRequestHandler):
                 <div class="refresh-info">
                     <p>🔄 Page auto-refreshes every 60 seconds</p>
                     <p>📊 <a href="/api/status" style="color: #ffd700;">View Raw JSON Data</a></p>
+                    <p>⚖️ <a href="/api/risk" style="color: #ffd700;">Portfolio Risk</a></p>
                     <p>🏥 <a href="/health" style="color: #ffd700;">Health Check</a></p>
                 </div>
             </div>
@@ -589,7 +833,8 @@ class DashboardHandler(BaseHTTPRequestHandler):
 def start_dashboard_server(port=8080):
     """Start the dashboard web server for Cloud Run"""
     server_address = ('', port)
-    httpd = HTTPServer(server_address, DashboardHandler)
+    # Threaded so /debug/profile can sample requests served concurrently
+    httpd = ThreadingHTTPServer(server_address, DashboardHandler)
     
     logger.info(f"🚀 LIVE DevOps Demo Dashboard starting on port {port}")
     logger.info("✅ Ready to accept HTTP traffic")